@@ -1,7 +1,10 @@
-import os, re, time, asyncio, tempfile, hashlib, sqlite3, threading, json
+import os, re, time, asyncio, tempfile, sqlite3, threading, json, uuid, secrets, heapq
+from collections import OrderedDict
+from contextlib import contextmanager
 from flask import Flask, request, jsonify, send_file, render_template
 from pydub import AudioSegment
 import edge_tts
+import blake3
 
 # -----------------------------------------------------------------------------
 # Configuration
@@ -11,117 +14,445 @@ app = Flask(__name__)
 CACHE_DIR = os.path.join(tempfile.gettempdir(), "tts_cache")
 os.makedirs(CACHE_DIR, exist_ok=True)
 DB_PATH = os.path.join(CACHE_DIR, "cache.db")
-
-progress_state = {}  # { job_id: {"done":int,"total":int,"status":str} }
+CACHE_MAX_AGE_HOURS = 6
+CACHE_MAX_MB = 500
+
+# Merged MP3s are short-lived and read straight back by send_file, so keep
+# them on tmpfs (RAM) when available. Cache files stay in CACHE_DIR.
+OUTPUT_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+
+# edge-tts default output format: audio-24khz-48kbitrate-mono-mp3
+EDGE_TTS_FRAME_RATE = 24000
+EDGE_TTS_KBPS = 48
+EDGE_TTS_BITRATE = f"{EDGE_TTS_KBPS}k"
+# MPEG-2 Layer III: 576 samples per frame, constant size at constant bitrate.
+MP3_FRAME_SAMPLES = 576
+MP3_FRAME_MS = 1000 * MP3_FRAME_SAMPLES / EDGE_TTS_FRAME_RATE  # 24 ms
+MP3_FRAME_BYTES = MP3_FRAME_SAMPLES // 8 * EDGE_TTS_KBPS * 1000 // EDGE_TTS_FRAME_RATE
+
+PROGRESS_MAX_JOBS = 1024
+PROGRESS_TTL = 3600  # seconds to keep finished jobs
+progress_state = OrderedDict()  # { job_id: {"done":int,"total":int,"status":str,"ts":float} }
+progress_lock = threading.Lock()
 
 # -----------------------------------------------------------------------------
 # SQLite cache index
 # -----------------------------------------------------------------------------
+_db = None
+db_lock = threading.Lock()
+
+CACHE_FLUSH_INTERVAL = 30  # seconds between flushes of buffered changes
+
+# In-memory LRU index of the cache, least recently used first.
+# SQLite is only read at startup; changes are buffered and flushed.
+CACHE_LRU = OrderedDict()  # { hash: [path, size, last access time] }
+cache_total = 0  # bytes referenced by CACHE_LRU
+ACCESS_BUFFER = {}  # { hash: last access time } not yet written to SQLite
+DELETE_BUFFER = {}  # { hash: path } evicted from CACHE_LRU but still in SQLite
+cache_lock = threading.Lock()
+_flusher_started = False
+
+def get_db():
+    """Return the shared SQLite connection, opening it on first use.
+
+    The connection is in autocommit mode (isolation_level=None); callers
+    hold db_lock and wrap multi-statement work in db_transaction() so a
+    failed statement is rolled back instead of leaving the shared
+    connection inside an open transaction.
+    """
+    global _db
+    with db_lock:
+        if _db is None:
+            conn = sqlite3.connect(DB_PATH, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA temp_store=MEMORY")
+            _db = conn
+    return _db
+
+@contextmanager
+def db_transaction(conn):
+    """BEGIN on `conn`, COMMIT on success, ROLLBACK and re-raise on error."""
+    conn.execute("BEGIN")
+    try:
+        yield conn
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
 def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS cache (
-            hash TEXT PRIMARY KEY,
-            voice TEXT,
-            text TEXT,
-            path TEXT,
-            size INTEGER,
-            mtime REAL
-        )
-    """)
-    conn.commit()
-    conn.close()
+    conn = get_db()
+    with db_lock:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS cache (
+                hash TEXT PRIMARY KEY,
+                voice TEXT,
+                text TEXT,
+                path TEXT,
+                size INTEGER,
+                mtime REAL
+            )
+        """)
+        migrate_cache_keys(conn)
+        load_cache_lru(conn)
+    start_cache_flusher()
+
+def migrate_cache_keys(conn):
+    """Rename cache entries whose hash predates the current cache_key().
+
+    Files are renamed first, then the index is updated in one transaction.
+    """
+    rows = conn.execute("SELECT hash,voice,text,path FROM cache").fetchall()
+    taken = {hashv for hashv, _, _, _ in rows}
+    renamed, dropped, stale, moves = [], [], [], []
+    for hashv, voice, text, path in rows:
+        new_key = cache_key(text, voice)
+        if new_key == hashv:
+            continue
+        new_path = os.path.join(CACHE_DIR, new_key + ".mp3")
+        try:
+            if new_key not in taken and os.path.exists(path):
+                os.replace(path, new_path)
+                moves.append((new_path, path))
+                renamed.append((new_key, new_path, hashv))
+                taken.add(new_key)
+            else:
+                dropped.append((hashv,))
+                stale.append(path)
+        except Exception as e:
+            print("cache migrate error:", e)
+    if not renamed and not dropped:
+        return
+    try:
+        with db_transaction(conn):
+            conn.executemany("UPDATE cache SET hash=?, path=? WHERE hash=?", renamed)
+            conn.executemany("DELETE FROM cache WHERE hash=?", dropped)
+    except Exception:
+        # Put the files back so they still match the rolled-back index.
+        for new_path, path in moves:
+            os.replace(new_path, path)
+        raise
+    _remove_cache_files(stale)
+
+def load_cache_lru(conn):
+    """Rebuild CACHE_LRU from SQLite, least recently used first."""
+    global cache_total
+    rows = conn.execute("SELECT hash,path,size,mtime FROM cache ORDER BY mtime").fetchall()
+    with cache_lock:
+        CACHE_LRU.clear()
+        for hashv, path, size, mtime in rows:
+            CACHE_LRU[hashv] = [path, size, mtime]
+        cache_total = sum(size for _, size, _ in CACHE_LRU.values())
+
+def _evict_lru(max_age_hours, max_total_mb, keep=0):
+    """Move expired and over-quota entries from CACHE_LRU to DELETE_BUFFER.
+
+    Caller holds cache_lock. The `keep` most recently used entries are never
+    evicted. Files are unlinked by db_flush() once the deletes are committed.
+    """
+    global cache_total
+    cutoff = time.time() - max_age_hours * 3600
+    while len(CACHE_LRU) > keep:
+        hashv, (path, size, mtime) = next(iter(CACHE_LRU.items()))
+        if mtime >= cutoff and cache_total <= max_total_mb * 1e6:
+            break
+        del CACHE_LRU[hashv]
+        ACCESS_BUFFER.pop(hashv, None)
+        DELETE_BUFFER[hashv] = path
+        cache_total -= size
+
+def _remove_cache_files(paths):
+    for path in paths:
+        try:
+            if os.path.exists(path):
+                os.remove(path)
+                print(f"[cache] removed {path}")
+        except Exception as e:
+            print("cache cleanup error:", e)
 
 def db_add_cache(hashv, voice, text, path):
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute(
-        "INSERT OR REPLACE INTO cache(hash,voice,text,path,size,mtime) VALUES(?,?,?,?,?,?)",
-        (hashv, voice, text, path, os.path.getsize(path), time.time()),
-    )
-    conn.commit()
-    conn.close()
+    global cache_total
+    size, now = os.path.getsize(path), time.time()
+    conn = get_db()
+    with db_lock:
+        conn.execute(
+            "INSERT INTO cache(hash,voice,text,path,size,mtime) VALUES(?,?,?,?,?,?) "
+            "ON CONFLICT(hash) DO UPDATE SET voice=excluded.voice, text=excluded.text, "
+            "path=excluded.path, size=excluded.size, mtime=excluded.mtime",
+            (hashv, voice, text, path, size, now),
+        )
+        with cache_lock:
+            old = CACHE_LRU.pop(hashv, None)
+            if old:
+                cache_total -= old[1]
+            DELETE_BUFFER.pop(hashv, None)
+            CACHE_LRU[hashv] = [path, size, now]
+            cache_total += size
+            _evict_lru(CACHE_MAX_AGE_HOURS, CACHE_MAX_MB, keep=1)
+            evicting = bool(DELETE_BUFFER)
+    if evicting:
+        try:
+            db_flush()
+        except Exception as e:
+            print("cache flush error:", e)
 
 def db_touch(hashv):
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("UPDATE cache SET mtime=? WHERE hash=?", (time.time(), hashv))
-    conn.commit()
-    conn.close()
-
-def db_cleanup(max_age_hours=6, max_total_mb=500):
-    """Remove cache files older than X hours or when total size exceeds limit."""
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("SELECT hash,path,size,mtime FROM cache")
-    rows = cur.fetchall()
-    conn.close()
-
+    """Record a cache hit; the access time is written by db_flush()."""
     now = time.time()
-    total_size = sum(r[2] for r in rows)
-    rows.sort(key=lambda r: r[3])  # oldest first
-
-    for hashv, path, size, mtime in rows:
-        if (now - mtime) > max_age_hours * 3600 or total_size > max_total_mb * 1e6:
+    with cache_lock:
+        entry = CACHE_LRU.get(hashv)
+        if entry:
+            entry[2] = now
+            CACHE_LRU.move_to_end(hashv)
+        ACCESS_BUFFER[hashv] = now
+
+def db_flush():
+    """Write buffered access times and evictions to SQLite in one transaction.
+
+    Evicted files are unlinked only after their deletes are committed. The
+    buffers are snapshotted while db_lock is held, so a concurrent
+    db_add_cache cannot re-add a row between the snapshot and the delete.
+    """
+    conn = get_db()
+    with db_lock:
+        with cache_lock:
+            if not ACCESS_BUFFER and not DELETE_BUFFER:
+                return
+            touched = [(mtime, hashv) for hashv, mtime in ACCESS_BUFFER.items()]
+            deleted = dict(DELETE_BUFFER)
+            ACCESS_BUFFER.clear()
+            DELETE_BUFFER.clear()
+        try:
+            with db_transaction(conn):
+                conn.executemany("UPDATE cache SET mtime=? WHERE hash=?", touched)
+                conn.executemany("DELETE FROM cache WHERE hash=?", [(h,) for h in deleted])
+        except Exception:
+            # Keep the batch for the next flush, without overwriting newer hits.
+            with cache_lock:
+                for mtime, hashv in touched:
+                    if ACCESS_BUFFER.get(hashv, 0) < mtime:
+                        ACCESS_BUFFER[hashv] = mtime
+                for hashv, path in deleted.items():
+                    if hashv not in CACHE_LRU:
+                        DELETE_BUFFER.setdefault(hashv, path)
+            raise
+    _remove_cache_files(deleted.values())
+
+def start_cache_flusher():
+    """Start the daemon thread that periodically runs db_flush()."""
+    global _flusher_started
+    with cache_lock:
+        if _flusher_started:
+            return
+        _flusher_started = True
+
+    def _run():
+        while True:
+            time.sleep(CACHE_FLUSH_INTERVAL)
             try:
-                if os.path.exists(path):
-                    os.remove(path)
-                    total_size -= size
-                    print(f"[cache] removed {path}")
+                db_flush()
             except Exception as e:
-                print("cache cleanup error:", e)
-            conn = sqlite3.connect(DB_PATH)
-            conn.execute("DELETE FROM cache WHERE hash=?", (hashv,))
-            conn.commit()
-            conn.close()
+                print("cache flush error:", e)
+
+    threading.Thread(target=_run, name="tts-cache-flush", daemon=True).start()
+
+def db_cleanup(max_age_hours=CACHE_MAX_AGE_HOURS, max_total_mb=CACHE_MAX_MB):
+    """Remove cache files older than X hours or when total size exceeds limit.
+
+    Entries are evicted least recently used first from CACHE_LRU, so no
+    table scan is needed. The SQLite deletes are committed in one batch
+    before the files are unlinked.
+    """
+    with cache_lock:
+        _evict_lru(max_age_hours, max_total_mb)
+    try:
+        db_flush()
+    except Exception as e:
+        print("cache flush error:", e)
+    sweep_progress()
 
 # -----------------------------------------------------------------------------
 # Cleanup helpers
 # -----------------------------------------------------------------------------
-def schedule_delete(path, delay=10):
-    """Delete file after a short delay to avoid send_file race."""
-    def _delete():
+_delete_queue = []  # heap of (deadline, path)
+_delete_cond = threading.Condition()
+_delete_worker = None
+
+def _run_delete_worker():
+    while True:
+        with _delete_cond:
+            while not _delete_queue or _delete_queue[0][0] > time.time():
+                timeout = _delete_queue[0][0] - time.time() if _delete_queue else None
+                _delete_cond.wait(timeout)
+            _, path = heapq.heappop(_delete_queue)
         try:
             if os.path.exists(path):
                 os.remove(path)
                 print(f"[cleanup] deleted {path}")
         except Exception as e:
             print(f"[cleanup error] {e}")
-    threading.Timer(delay, _delete).start()
+
+def schedule_delete(path, delay=10):
+    """Delete file after a short delay to avoid send_file race.
+
+    Deletions are queued for one shared worker thread instead of a timer
+    thread per file.
+    """
+    global _delete_worker
+    with _delete_cond:
+        if _delete_worker is None:
+            _delete_worker = threading.Thread(target=_run_delete_worker,
+                                              name="tts-delete", daemon=True)
+            _delete_worker.start()
+        heapq.heappush(_delete_queue, (time.time() + delay, path))
+        _delete_cond.notify()
+
+# -----------------------------------------------------------------------------
+# Progress tracking
+# -----------------------------------------------------------------------------
+def set_progress(job_id, **fields):
+    """Create or update a job's progress entry, evicting the oldest past the cap."""
+    with progress_lock:
+        info = progress_state.setdefault(job_id, {"done": 0, "total": 0, "status": ""})
+        info.update(fields, ts=time.time())
+        progress_state.move_to_end(job_id)
+        while len(progress_state) > PROGRESS_MAX_JOBS:
+            progress_state.popitem(last=False)
+
+def get_progress(job_id):
+    with progress_lock:
+        info = progress_state.get(job_id)
+        return dict(info) if info else None
+
+def sweep_progress():
+    """Drop finished jobs older than PROGRESS_TTL."""
+    cutoff = time.time() - PROGRESS_TTL
+    with progress_lock:
+        for job_id in [j for j, info in progress_state.items()
+                       if info["status"] == "Complete" and info["ts"] < cutoff]:
+            del progress_state[job_id]
+
+# -----------------------------------------------------------------------------
+# Background event loop
+# -----------------------------------------------------------------------------
+_loop = None
+_loop_lock = threading.Lock()
+
+def get_loop():
+    """Return the shared asyncio loop, starting its daemon thread on first use."""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="tts-loop", daemon=True).start()
+    return _loop
+
+def run_async(coro):
+    """Run a coroutine on the shared loop and block until it finishes."""
+    return asyncio.run_coroutine_threadsafe(coro, get_loop()).result()
 
 # -----------------------------------------------------------------------------
 # Voice listing
 # -----------------------------------------------------------------------------
+VOICES_TTL = 3600  # seconds before the voice list is fetched again
+VOICES_RETRY = 60  # seconds to wait after a failed fetch before trying again
+VOICES_PATH = os.path.join(CACHE_DIR, "voices.json")
+VOICES_FALLBACK = ["en-US-AriaNeural", "en-US-GuyNeural"]
+_VOICES_CACHE = {"ts": 0, "names": []}
+_voices_lock = threading.Lock()  # guards _VOICES_CACHE
+_voices_fetch_lock = threading.Lock()  # held by the one thread fetching
+
+def _voices_fresh():
+    """Return the cached names if still within their TTL, else None."""
+    with _voices_lock:
+        if not _VOICES_CACHE["names"] and not _VOICES_CACHE["ts"] and os.path.exists(VOICES_PATH):
+            try:
+                with open(VOICES_PATH) as f:
+                    _VOICES_CACHE.update(json.load(f))
+            except Exception as e:
+                print("voice cache read error:", e)
+        if time.time() - _VOICES_CACHE["ts"] < VOICES_TTL:
+            return _VOICES_CACHE["names"] or VOICES_FALLBACK
+        return None
+
+def list_voice_names():
+    """Return sorted voice short names, fetched at most once per VOICES_TTL.
+
+    The list is kept in memory and in VOICES_PATH so restarts skip the fetch.
+    While a stale list exists it is served immediately and only one request
+    refreshes it; only an empty cache waits for the fetch. A failed fetch is
+    not retried for VOICES_RETRY seconds.
+    """
+    names = _voices_fresh()
+    if names is not None:
+        return names
+    with _voices_lock:
+        stale = _VOICES_CACHE["names"]
+    if not _voices_fetch_lock.acquire(blocking=not stale):
+        return stale
+    try:
+        names = _voices_fresh()  # another thread may have fetched while we waited
+        if names is not None:
+            return names
+        try:
+            result = run_async(edge_tts.list_voices())
+            names = sorted({v["ShortName"] for v in result})
+        except Exception as e:
+            print("voice list error:", e)
+            with _voices_lock:
+                _VOICES_CACHE["ts"] = time.time() - VOICES_TTL + VOICES_RETRY
+            return stale or VOICES_FALLBACK
+        with _voices_lock:
+            _VOICES_CACHE.update(ts=time.time(), names=names)
+            snapshot = dict(_VOICES_CACHE)
+        try:
+            with open(VOICES_PATH, "w") as f:
+                json.dump(snapshot, f)
+        except Exception as e:
+            print("voice cache write error:", e)
+        return names
+    finally:
+        _voices_fetch_lock.release()
+
 @app.route("/voices")
 def voices():
     """Return available Edge-TTS voice short names."""
-    try:
-        result = asyncio.run(edge_tts.list_voices())
-        names = sorted({v["ShortName"] for v in result})
-    except Exception as e:
-        print("voice list error:", e)
-        names = ["en-US-AriaNeural", "en-US-GuyNeural"]
-    return jsonify(names)
+    return jsonify(list_voice_names())
 
 # -----------------------------------------------------------------------------
 # TTS helpers
 # -----------------------------------------------------------------------------
 def cache_key(text, voice):
-    return hashlib.sha1(f"{voice}|{text}".encode("utf-8")).hexdigest()
+    return blake3.blake3(f"{voice}|{text}".encode("utf-8")).hexdigest(length=20)
 
 async def edge_tts_save(text, voice, path):
+    """Stream synthesized audio to `path`, renaming into place only on success."""
     com = edge_tts.Communicate(text, voice)
-    await com.save(path)
+    tmp = f"{path}.{os.getpid()}.{id(com)}.part"
+    try:
+        with open(tmp, "wb") as f:
+            async for chunk in com.stream():
+                if chunk["type"] == "audio":
+                    f.write(chunk["data"])
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+_TAG_RE = re.compile(
+    r'\[voice\s+([^\]]+)\]\s*:\s*([^\[]*)|\[pause\s*(\d+(?:\.\d+)?)\s*(?:s|sec|seconds)?\]',
+    re.I,
+)
 
 def parse_tags_into_segments(text, default_voice):
     """Parse text for [voice id]: and [pause n]."""
-    regex = re.compile(
-        r'\[voice\s+([^\]]+)\]\s*:\s*([^\[]*)|\[pause\s*(\d+(?:\.\d+)?)\s*(?:s|sec|seconds)?\]',
-        re.I,
-    )
+    if "[" not in text:
+        # No tag can match; skip the regex scan over plain prose.
+        text = text.strip()
+        return [{"type": "text", "content": text}] if text else []
     segments, last = [], 0
-    for m in regex.finditer(text):
+    for m in _TAG_RE.finditer(text):
         if m.start() > last:
             before = text[last:m.start()].strip()
             if before:
@@ -140,65 +471,191 @@ def parse_tags_into_segments(text, default_voice):
         segments.append({"type": "text", "content": tail})
     return segments
 
-def synthesize_segments_to_mp3(segments, default_voice, job_id=None):
-    merged = AudioSegment.silent(duration=0)
+EDGE_TTS_MAX_CONNECTIONS = 8  # process-wide cap on concurrent WebSockets
+_edge_tts_sem = None
+
+async def edge_tts_save_all(jobs, on_done=None):
+    """Run edge_tts_save for every (text, voice, path) job concurrently.
+
+    A semaphore shared by every request on the background loop caps the
+    number of simultaneous WebSocket connections for the whole process.
+    `on_done`, if given, is called with no arguments as each job finishes.
+    Returns one result per job: None on success or the raised exception.
+    """
+    global _edge_tts_sem
+    if _edge_tts_sem is None:  # created on the shared loop's thread
+        _edge_tts_sem = asyncio.Semaphore(EDGE_TTS_MAX_CONNECTIONS)
+    sem = _edge_tts_sem
+
+    async def _one(text, voice, path):
+        try:
+            async with sem:
+                await edge_tts_save(text, voice, path)
+        finally:
+            if on_done:
+                on_done()
+
+    return await asyncio.gather(*[_one(t, v, p) for t, v, p in jobs],
+                                return_exceptions=True)
+
+_silence_frame = None
+_silence_lock = threading.Lock()
+
+def silence_frame():
+    """Return a single silent MP3 frame matching edge-tts output.
+
+    Encoded once (and kept in CACHE_DIR across restarts) by cutting one frame
+    out of the middle of a short silent clip.
+    """
+    global _silence_frame
+    with _silence_lock:
+        if _silence_frame is None:
+            path = os.path.join(CACHE_DIR, "silence_frame.mp3")
+            if not os.path.exists(path):
+                tmp = f"{path}.{os.getpid()}.part"
+                encode_silence(1000, tmp)
+                with open(tmp, "rb") as f:
+                    data = f.read()
+                os.remove(tmp)
+                mid = (len(data) // MP3_FRAME_BYTES // 2) * MP3_FRAME_BYTES
+                frame = data[mid:mid + MP3_FRAME_BYTES]
+                if len(frame) != MP3_FRAME_BYTES or frame[0] != 0xFF or frame[1] & 0xE0 != 0xE0:
+                    raise ValueError("unexpected MP3 frame layout in encoded silence")
+                with open(path, "wb") as f:
+                    f.write(frame)
+            with open(path, "rb") as f:
+                _silence_frame = f.read()
+    return _silence_frame
+
+def silence_bytes(ms):
+    """Return `ms` of silence as raw MP3 frames, rounded to whole frames."""
+    return silence_frame() * round(ms / MP3_FRAME_MS)
+
+def encode_silence(ms, path):
+    """Encode `ms` of silence to MP3 with the edge-tts output parameters."""
+    AudioSegment.silent(duration=ms, frame_rate=EDGE_TTS_FRAME_RATE).export(
+        path, format="mp3", bitrate=EDGE_TTS_BITRATE,
+        parameters=["-write_xing", "0", "-id3v2_version", "0", "-reservoir", "0"],
+    )
+
+_OUTPUT_NAME_RE = re.compile(r"tts_[0-9a-f]{32}\.mp3")
+
+def output_path():
+    """Return a fresh path in OUTPUT_DIR for a merged MP3."""
+    return os.path.join(OUTPUT_DIR, f"tts_{uuid.uuid4().hex}.mp3")
+
+def concat_mp3(parts, out_path):
+    """Join MP3 parts by appending their raw frames, without re-encoding.
+
+    Each part is either a file path or a bytes object of MP3 frames.
+    """
+    with open(out_path, "wb") as out:
+        for p in parts:
+            if isinstance(p, bytes):
+                out.write(p)
+                continue
+            with open(p, "rb") as f:
+                out.write(f.read())
+
+def resolve_segments(segments, default_voice, job_id=None):
+    """Synthesize any uncached text segments and return the playback plan.
+
+    The plan is a list of ("text", cached_path) and ("pause", seconds) items
+    in original order.
+    """
     current_voice = default_voice
-    total = len(segments)
-    done = 0
-    if job_id:
-        progress_state[job_id] = {"done": 0, "total": total, "status": "Starting"}
 
+    # Pass 1: resolve the voice for each text segment and find cache misses.
+    # Repeated (voice, text) pairs are looked up and synthesized only once.
+    plan, jobs, resolved = [], [], {}
     for seg in segments:
-        if job_id:
-            progress_state[job_id].update(done=done, status=f"Segment {done+1}/{total}")
-
         if seg["type"] == "voice":
             current_voice = seg["name"]
-            done += 1
-            continue
         elif seg["type"] == "pause":
-            merged += AudioSegment.silent(duration=int(seg["duration"] * 1000))
-            done += 1
-            continue
+            plan.append(("pause", seg["duration"]))
         elif seg["type"] == "text":
             text = seg["content"].strip()
             if not text:
-                done += 1
                 continue
+            cached_path = resolved.get((current_voice, text))
+            if cached_path is None:
+                key = cache_key(text, current_voice)
+                cached_path = os.path.join(CACHE_DIR, key + ".mp3")
+                if os.path.exists(cached_path):
+                    db_touch(key)
+                else:
+                    jobs.append((key, text, current_voice, cached_path))
+                resolved[(current_voice, text)] = cached_path
+            plan.append(("text", cached_path))
+
+    # Pass 2: synthesize all cache misses concurrently. Progress counts each
+    # synthesized segment, then each merged plan item (see merge_plan).
+    on_done = None
+    if job_id:
+        set_progress(job_id, done=0, total=len(jobs) + len(plan))
+        finished = [0]
+
+        def _advance():
+            finished[0] += 1
+            set_progress(job_id, done=finished[0],
+                         status=f"Synthesized {finished[0]}/{len(jobs)} segment(s)")
+        on_done = _advance
+    if jobs:
+        results = run_async(edge_tts_save_all([(t, v, p) for _, t, v, p in jobs],
+                                              on_done=on_done))
+        for (key, text, voice, path), err in zip(jobs, results):
+            if err is not None:
+                print("edge-tts error:", err)
+                continue
+            try:
+                db_add_cache(key, voice, text, path)
+            except Exception as e:
+                print("cache index error:", e)
+    return plan
 
-            key = cache_key(text, current_voice)
-            cached_path = os.path.join(CACHE_DIR, key + ".mp3")
+def merge_plan(plan, job_id=None, offset=0):
+    """Stitch a resolved plan into a new MP3 in OUTPUT_DIR and return its path.
 
-            if os.path.exists(cached_path):
-                db_touch(key)
-            else:
-                try:
-                    asyncio.run(edge_tts_save(text, current_voice, cached_path))
-                    db_add_cache(key, current_voice, text, cached_path)
-                except Exception as e:
-                    print("edge-tts error:", e)
-                    merged += AudioSegment.silent(duration=500)
-                    done += 1
-                    continue
+    `offset` is the job's progress count before merging starts.
+    """
+    parts = []
+    for done, (kind, value) in enumerate(plan):
+        if job_id:
+            set_progress(job_id, done=offset + done, status=f"Segment {done+1}/{len(plan)}")
 
-            try:
-                part = AudioSegment.from_file(cached_path, format="mp3")
-                merged += part
-            except Exception as e:
-                print("pydub error:", e)
-                merged += AudioSegment.silent(duration=500)
+        if kind == "pause":
+            parts.append(silence_bytes(value * 1000))
+        elif os.path.exists(value):
+            parts.append(value)
+        else:
+            parts.append(silence_bytes(500))
 
-            done += 1
+    final_path = output_path()
+    concat_mp3(parts, final_path)
+    return final_path
 
-    final_path = tempfile.mktemp(suffix=".mp3")
-    merged.export(final_path, format="mp3")
+def synthesize_segments_to_mp3(segments, default_voice, job_id=None):
     if job_id:
-        progress_state[job_id] = {"done": total, "total": total, "status": "Complete"}
+        set_progress(job_id, done=0, total=len(segments), status="Starting")
+    plan = resolve_segments(segments, default_voice, job_id)
+    if not job_id:
+        return merge_plan(plan)
+    total = get_progress(job_id)["total"]
+    final_path = merge_plan(plan, job_id, offset=total - len(plan))
+    set_progress(job_id, done=total, status="Complete")
     return final_path
 
 # -----------------------------------------------------------------------------
 # Routes
 # -----------------------------------------------------------------------------
+def send_mp3(path, download_name):
+    """send_file an MP3 with Range/If-Modified-Since support for <audio> seeking.
+
+    werkzeug serves ranges (and sets Accept-Ranges) only for GET/HEAD.
+    """
+    return send_file(path, mimetype="audio/mpeg", as_attachment=True,
+                     download_name=download_name, conditional=True)
+
 @app.route("/")
 def index():
     return render_template("index.html")
@@ -212,10 +669,15 @@ def tts_single():
         return jsonify({"error": "Missing text"}), 400
 
     segs = parse_tags_into_segments(text, voice)
-    out_path = synthesize_segments_to_mp3(segs, voice)
-    resp = send_file(out_path, mimetype="audio/mpeg", as_attachment=True,
-                     download_name=f"{voice}.mp3")
-    schedule_delete(out_path)
+    plan = resolve_segments(segs, voice)
+    if len(plan) == 1 and plan[0][0] == "text" and os.path.exists(plan[0][1]):
+        # A lone text segment is already the final MP3: serve the cache file
+        # itself and leave it in place for the next request.
+        resp = send_mp3(plan[0][1], f"{voice}.mp3")
+    else:
+        out_path = merge_plan(plan)
+        resp = send_mp3(out_path, f"{voice}.mp3")
+        schedule_delete(out_path)
     db_cleanup()
     return resp
 
@@ -226,39 +688,42 @@ def tts_all():
     if not blocks:
         return jsonify({"error": "No blocks"}), 400
 
-    job_id = str(int(time.time() * 1000))
-    progress_state[job_id] = {"done": 0, "total": len(blocks), "status": "Queued"}
+    job_id = secrets.token_hex(8)
+    set_progress(job_id, done=0, total=len(blocks), status="Queued")
 
-    merged = AudioSegment.silent(duration=0)
+    parts, block_paths, gap = [], [], silence_bytes(500)
     for i, b in enumerate(blocks):
         text = b.get("text", "")
         voice = b.get("voice", "en-US-AriaNeural")
         segs = parse_tags_into_segments(text, voice)
-        progress_state[job_id].update(done=i, status=f"Block {i+1}/{len(blocks)}")
+        set_progress(job_id, done=i, status=f"Block {i+1}/{len(blocks)}")
         block_path = synthesize_segments_to_mp3(segs, voice, job_id)
-        merged += AudioSegment.from_file(block_path, format="mp3")
-        merged += AudioSegment.silent(duration=500)
-        schedule_delete(block_path, delay=5)
+        parts += [block_path, gap]
+        block_paths.append(block_path)
 
-    final_path = tempfile.mktemp(suffix=".mp3")
-    merged.export(final_path, format="mp3")
-    progress_state[job_id] = {"done": len(blocks), "total": len(blocks), "status": "Complete"}
+    final_path = output_path()
+    concat_mp3(parts, final_path)
+    for block_path in block_paths:
+        schedule_delete(block_path, delay=5)
+    set_progress(job_id, done=len(blocks), total=len(blocks), status="Complete")
     db_cleanup()
     schedule_delete(final_path, delay=600)
     return jsonify({"job_id": job_id, "download": f"/download/{os.path.basename(final_path)}"})
 
 @app.route("/download/<fname>")
 def download(fname):
-    path = os.path.join(tempfile.gettempdir(), fname)
-    if not os.path.exists(path):
+    # OUTPUT_DIR may be /dev/shm, shared with other processes' IPC objects:
+    # only serve names that output_path() could have produced.
+    path = os.path.join(OUTPUT_DIR, fname)
+    if not _OUTPUT_NAME_RE.fullmatch(fname) or not os.path.exists(path):
         return jsonify({"error": "not found"}), 404
-    resp = send_file(path, mimetype="audio/mpeg", as_attachment=True, download_name=fname)
-    schedule_delete(path)
-    return resp
+    # The file's lifetime is owned by the schedule_delete in tts_all, so
+    # range and resume requests keep working until it expires.
+    return send_mp3(path, fname)
 
 @app.route("/progress/<job_id>")
 def progress(job_id):
-    info = progress_state.get(job_id)
+    info = get_progress(job_id)
     if not info:
         return jsonify({"error": "no such job"}), 404
     pct = round(100 * info["done"] / max(1, info["total"]), 1)
@@ -282,5 +747,10 @@ if __name__ == "__main__":
 
     init_db()
     db_cleanup()
+    get_loop()
+    try:
+        silence_frame()  # encode the pause frame now rather than on the first request
+    except Exception as e:
+        print("silence frame error:", e)
     app.run(debug=args.debug, host=args.host, port=args.port)
 